@@ -22,12 +22,15 @@
 #
 
 import datetime
+import functools
 import hashlib
+import itertools
 import json
 import logging
 import re
 import textwrap
-from typing import Any, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Tuple
 
 import coloredlogs
 import requests
@@ -42,6 +45,7 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(me
 
 WS_DIR = "codegen/ws"  # TODO use path from py
 SCHEMA_OUT = {}
+SCHEMA_ENDPOINTS = []
 HTTP_METHODS = ["get", "put", "post", "delete", "patch"]
 SPECS = {
     "core": {
@@ -64,8 +68,11 @@ RESERVED_WORDS = ["from"]
 REF_DB_BRANCH_NAME_PARAM = "#/components/parameters/DBBranchNameParam"
 REF_WORKSPACE_ID_PARAM = "#/components/parameters/WorkspaceIDParam"
 REF_WORKSPACE_ID_PARAM_EXCLUSIONS = [""]
-API_RENAMING = json.load(open("codegen/api-rename-mapping.json"))
+API_RENAMING_FILE = "codegen/api-rename-mapping.json"
 DEFAULT_TEMPLATE_REF = "endpoint"
+WRITE_BUFFER_SIZE = 1 << 20
+PATH_BRACES_RE = re.compile(r"[{}]")
+PARAM_NAME_SPLIT_RE = re.compile("[a-zA-Z][^A-Z]*")
 
 OPTIONAL_CURATED_PARAM_DB_NAME = {
     "name": "db_name",
@@ -113,24 +120,45 @@ def fetch_openapi_specs(spec_url: str) -> dict:
     return r.json()
 
 
+@functools.lru_cache(maxsize=None)
+def _get_template(path: str) -> Template:
+    """
+    Compile a template once and reuse it for every subsequent render
+    """
+    return Template(filename=path, output_encoding="utf-8")
+
+
+@functools.lru_cache(maxsize=None)
+def get_api_renaming() -> Dict[Tuple[str, str], dict]:
+    """
+    Load the API renaming map once, keyed by (namespace, operation id)
+    """
+    with open(API_RENAMING_FILE) as fh:
+        renaming = json.load(fh)
+    return {(ns, op): r for ns, ops in renaming.items() for op, r in ops.items()}
+
+
+@functools.lru_cache(maxsize=None)
 def get_class_name(name: str) -> str:
     return "".join([n.capitalize() for n in name.lower().split(" ")])
 
 
+@functools.lru_cache(maxsize=None)
 def get_param_name(name: str) -> str:
-    name = "_".join([n.lower() for n in re.findall("[a-zA-Z][^A-Z]*", name)])
+    name = "_".join([n.lower() for n in PARAM_NAME_SPLIT_RE.findall(name)])
     if name in RESERVED_WORDS:
         name = f"{name}_"
     return name
 
 
-def generate_namespace(namespace: dict, scope: str, spec_version: str, spec_base_url: str):
+def generate_namespace(
+    namespace: dict, scope: str, spec_version: str, spec_base_url: str, buffers: Dict[str, List[bytes]]
+):
     """
-    Generate the namespaced Class for the endpoints
+    Generate the namespaced Class for the endpoints and buffer it as the head of the namespace file
     """
-    if "description" in namespace:
-        class_desc = namespace["description"]
-    else:
+    class_desc = namespace.get("description")
+    if class_desc is None:
         class_desc = namespace["x-displayName"]
         logging.warn("missing description: %s.%s" % (scope, namespace["x-displayName"]))
     vars = {
@@ -139,66 +167,68 @@ def generate_namespace(namespace: dict, scope: str, spec_version: str, spec_base
         "spec_scope": scope,
         "spec_version": spec_version,
     }
-    out = Template(filename="codegen/templates/namespace.tpl", output_encoding="utf-8").render(**vars)
+    out = _get_template("codegen/templates/namespace.tpl").render(**vars)
     file_name = "%s/%s.py" % (WS_DIR, _sanitize_filename(namespace["name"]))
-    fh = open(file_name, "w+")
-    fh.write(out.decode("utf-8"))
-    fh.close()
-    logging.info("created namespace class %s in %s" % (namespace["name"], file_name))
+    buffers[file_name] = [out]
+    logging.info("buffered namespace class %s for %s" % (namespace["name"], file_name))
 
 
-def generate_endpoints(path: str, endpoints: dict, references: dict):
+def generate_endpoints(path: str, endpoints: dict, references: dict, buffers: Dict[str, List[bytes]]):
     """
-    Generate the endpoints of a namespace
+    Generate the endpoints of a namespace and buffer them per namespace file
     """
-    params = endpoints["parameters"] if "parameters" in endpoints else []
+    params = endpoints.get("parameters", [])
     for method in HTTP_METHODS:
         if method in endpoints:
             out = generate_endpoint(path, method, endpoints[method], params, references)
             file_name = "%s/%s.py" % (WS_DIR, _sanitize_filename(endpoints[method]["tags"][0]))
-            fh = open(file_name, "a+")
-            fh.write(out.decode("utf-8"))
-            fh.close()
-            logging.info("appended endpoint %s to %s" % (endpoints[method]["operationId"], file_name))
+            buffers.setdefault(file_name, []).append(out)
+            logging.info("buffered endpoint %s for %s" % (endpoints[method]["operationId"], file_name))
+
+
+def write_namespaces(buffers: Dict[str, List[bytes]]):
+    """
+    Write the buffered namespace classes and their endpoints, opening each file once
+    """
+    for file_name, chunks in buffers.items():
+        with open(file_name, "wb") as fh:
+            fh.writelines(chunks)
+        logging.info("created %s" % file_name)
 
 
 def prune_empty_namespaces(spec: dict) -> list[str]:
-    n_spaces = {}
-    for n in spec["tags"]:
-        n_spaces[n["name"]] = 0
-    for p in spec["paths"].values():
-        for method in HTTP_METHODS:
-            if method in p:
-                n_spaces[p[method]["tags"][0]] += 1
-    namespaces = []
-    for n in spec["tags"]:
-        if n_spaces[n["name"]] > 0:
-            namespaces.append(n)
-    return namespaces
+    used = {p[method]["tags"][0] for p in spec["paths"].values() for method in HTTP_METHODS if method in p}
+    undeclared = used - {n["name"] for n in spec["tags"]}
+    if undeclared:
+        logging.error("could not find namespace(s) %s in the spec tags." % ", ".join(sorted(undeclared)))
+        exit(12)
+    return [n for n in spec["tags"] if n["name"] in used]
 
 
 def generate_endpoint(path: str, method: str, endpoint: dict, parameters: list, references: dict) -> str:
     """
     Generate a single endpoint
     """
-    if "parameters" in endpoint:
-        endpoint_params = get_endpoint_params(path, endpoint, parameters + endpoint["parameters"], references)
-    else:
-        endpoint_params = get_endpoint_params(path, endpoint, parameters, references)
-    if "description" in endpoint:
-        desc = endpoint["description"].strip()
-    else:
+    endpoint_params = get_endpoint_params(
+        path, endpoint, itertools.chain(parameters, endpoint.get("parameters", ())), references
+    )
+    summary = endpoint["summary"]
+    desc = endpoint.get("description")
+    if desc is None:
         logging.info("missing description for %s.%s - using summary." % (path, endpoint["operationId"]))
-        desc = endpoint["summary"].strip()
+        desc = summary
+    desc = desc.strip()
 
     # replacements
     namespace = _sanitize_filename(endpoint["tags"][0])
-    operation_id = endpoint["operationId"].strip()
+    spec_operation_id = endpoint["operationId"].strip()
+    operation_id = spec_operation_id
     template_ref = DEFAULT_TEMPLATE_REF
-    if namespace in API_RENAMING and operation_id in API_RENAMING[namespace]:
-        template_ref = API_RENAMING[namespace][operation_id]["template"]
-        operation_id = API_RENAMING[namespace][operation_id]["name"]
-        logging.debug("replacing name from %s.%s to %s." % (namespace, endpoint["operationId"].strip(), operation_id))
+    renamed = get_api_renaming().get((namespace, spec_operation_id))
+    if renamed is not None:
+        template_ref = renamed["template"]
+        operation_id = renamed["name"]
+        logging.debug("replacing name from %s.%s to %s." % (namespace, spec_operation_id, operation_id))
 
     # status of the API
     status = "GA"
@@ -207,8 +237,8 @@ def generate_endpoint(path: str, method: str, endpoint: dict, parameters: list,
 
     # docs url
     slug = "%s#%s" % (
-        re.sub("[\{\}]", "", path.strip()),
-        re.sub("[ ]", "-", endpoint["summary"].lower()),
+        PATH_BRACES_RE.sub("", path.strip()),
+        summary.lower().replace(" ", "-"),
     )
 
     # template variables
@@ -223,10 +253,10 @@ def generate_endpoint(path: str, method: str, endpoint: dict, parameters: list,
         "docs_url": f"https://xata.io/docs/api-reference{slug}",
     }
 
-    SCHEMA_OUT["endpoints"].append(
+    SCHEMA_ENDPOINTS.append(
         {
             "namespace": endpoint["tags"][0],
-            "name": endpoint["summary"].strip(),
+            "name": summary.strip(),
             "operation_id": endpoint["operationId"],
             "name_python": operation_id,
             "description": desc,
@@ -236,17 +266,17 @@ def generate_endpoint(path: str, method: str, endpoint: dict, parameters: list,
             "status": status,
             "parameters": [
                 {"name": p["name"], "description": p["description"], "in": p["in"], "required": p["required"]}
-                for p in list(endpoint_params["list"])
+                for p in endpoint_params["list"]
             ],
         }
     )
 
     # render template
     template_path = "codegen/templates/%s.tpl" % vars["template"]
-    return Template(filename=template_path, output_encoding="utf-8").render(**vars)
+    return _get_template(template_path).render(**vars)
 
 
-def get_endpoint_params(path: str, endpoint: dict, parameters: dict, references: dict) -> list:
+def get_endpoint_params(path: str, endpoint: dict, parameters: Iterable[dict], references: dict) -> list:
     skel = {
         "list": [],
         "has_path_params": 0,
@@ -258,90 +288,89 @@ def get_endpoint_params(path: str, endpoint: dict, parameters: dict, references:
         "response_codes": [],
         "response_content_types": [],
     }
-    if len(parameters) > 0:
-        # Check for convience param swaps
-        curated_param_list = []
-        for r in parameters:
-            if "$ref" in r and r["$ref"] == REF_DB_BRANCH_NAME_PARAM:
-                logging.debug("adding smart value for %s" % "#/components/parameters/DBBranchNameParam")
-                # push two new params to cover for string creation
-                curated_param_list.append(OPTIONAL_CURATED_PARAM_DB_NAME)
-                curated_param_list.append(OPTIONAL_CURATED_PARAM_BRANCH_NAME)
-                skel["smart_db_branch_name"] = True
-            elif "$ref" in r and r["$ref"] == REF_WORKSPACE_ID_PARAM:
-                # and endpoint['operationId'] not in REF_WORKSPACE_ID_PARAM_EXCLUSIONS:
-                logging.debug("adding smart value for %s" % "#/components/parameters/WorkspaceIdParam")
-                curated_param_list.append(OPTIONAL_CURATED_PARAM_WORKSPACE_ID)
-                skel["smart_workspace_id"] = True
-            else:
-                curated_param_list.append(r)
-
-        for r in curated_param_list:
-            p = None
-            # if not in ref: endpoint specific params
-            if "$ref" in r and r["$ref"] in references:
-                p = references[r["$ref"]]
-                if "$ref" in p["schema"]:
-                    p["type"] = type_replacement(references[p["schema"]["$ref"]]["type"])
-                elif "type" in p["schema"]:
-                    p["type"] = type_replacement(p["schema"]["type"])
-                else:
-                    logging.error("could resolve type of '%s' in the lookup." % r["$ref"])
-                    exit(11)
-            # else if name not in r: method specific params
-            elif "name" in r:
-                p = r
-                p["type"] = type_replacement(r["schema"]["type"])
-            # else fail with code: 11
+    # Check for convience param swaps
+    curated_param_list = []
+    for r in parameters:
+        ref = r.get("$ref")
+        if ref == REF_DB_BRANCH_NAME_PARAM:
+            logging.debug("adding smart value for %s" % "#/components/parameters/DBBranchNameParam")
+            # push two new params to cover for string creation
+            curated_param_list.append(OPTIONAL_CURATED_PARAM_DB_NAME)
+            curated_param_list.append(OPTIONAL_CURATED_PARAM_BRANCH_NAME)
+            skel["smart_db_branch_name"] = True
+        elif ref == REF_WORKSPACE_ID_PARAM:
+            # and endpoint['operationId'] not in REF_WORKSPACE_ID_PARAM_EXCLUSIONS:
+            logging.debug("adding smart value for %s" % "#/components/parameters/WorkspaceIdParam")
+            curated_param_list.append(OPTIONAL_CURATED_PARAM_WORKSPACE_ID)
+            skel["smart_workspace_id"] = True
+        else:
+            curated_param_list.append(r)
+
+    for r in curated_param_list:
+        ref = r.get("$ref")
+        p = references.get(ref)
+        # if not in ref: endpoint specific params
+        if p is not None:
+            schema = p["schema"]
+            schema_ref = schema.get("$ref")
+            if schema_ref is not None:
+                p["type"] = type_replacement(references[schema_ref]["type"])
+            elif "type" in schema:
+                p["type"] = type_replacement(schema["type"])
             else:
-                logging.error("could resolve reference %s in the lookup." % r["$ref"])
+                logging.error("could resolve type of '%s' in the lookup." % ref)
                 exit(11)
-
-            if "required" not in p:
-                p["required"] = False
-            if "description" not in p:
-                p["description"] = ""
-
-            p["name"] = p["name"].strip()
-            p["nameParam"] = get_param_name(p["name"])
-            p["description"] = p["description"].strip()
-            p["trueType"] = p["type"]
-            if not p["required"]:
-                p["type"] += " = None"
-
-            skel["list"].append(p)
-
-            if p["in"] == "path":
-                skel["has_path_params"] += 1
-            if p["in"] == "query":
-                skel["has_query_params"] += 1
-            if not p["required"]:
-                skel["has_optional_params"] += 1
+        # else if name not in r: method specific params
+        elif "name" in r:
+            p = r
+            p["type"] = type_replacement(r["schema"]["type"])
+        # else fail with code: 11
+        else:
+            logging.error("could resolve reference %s in the lookup." % ref)
+            exit(11)
+
+        p.setdefault("required", False)
+        p.setdefault("description", "")
+
+        p["name"] = p["name"].strip()
+        p["nameParam"] = get_param_name(p["name"])
+        p["description"] = p["description"].strip()
+        p["trueType"] = p["type"]
+        if not p["required"]:
+            p["type"] += " = None"
+
+        skel["list"].append(p)
+
+        if p["in"] == "path":
+            skel["has_path_params"] += 1
+        if p["in"] == "query":
+            skel["has_query_params"] += 1
+        if not p["required"]:
+            skel["has_optional_params"] += 1
 
     if "requestBody" in endpoint:
         skel["list"].append(OPTIONAL_CURATED_PARAM_PAYLOAD)
         skel["has_payload"] = True
 
     # collect response schema
-    if "responses" in endpoint:
-        for code in endpoint["responses"]:
-            desc = ""
-            if "description" in endpoint["responses"][code]:
-                desc = endpoint["responses"][code]["description"].strip()
-            elif "$ref" in endpoint["responses"][code] and endpoint["responses"][code]["$ref"] in references:
-                desc = references[endpoint["responses"][code]["$ref"]]["description"].strip()
-            skel["response_codes"].append(
-                {
-                    "code": code,
-                    "description": desc,
-                }
-            )
-            # get content types
-            if "content" in endpoint["responses"][code]:
-                int_code = int(code)
-                if int_code >= 200 and int_code <= 299:
-                    for ct in endpoint["responses"][code]["content"]:
-                        skel["response_content_types"].append({"content_type": ct, "code": code})
+    for code, response in endpoint.get("responses", {}).items():
+        desc = response.get("description")
+        if desc is None:
+            desc = references.get(response.get("$ref"), {"description": ""})["description"]
+        desc = desc.strip()
+        skel["response_codes"].append(
+            {
+                "code": code,
+                "description": desc,
+            }
+        )
+        # get content types
+        content = response.get("content")
+        if content is not None:
+            int_code = int(code)
+            if int_code >= 200 and int_code <= 299:
+                for ct in content:
+                    skel["response_content_types"].append({"content_type": ct, "code": code})
     # Multiple Response Content types require option for users
     if len(skel["response_content_types"]) > 1:
         skel["has_optional_params"] = True
@@ -358,16 +387,17 @@ def get_endpoint_params(path: str, endpoint: dict, parameters: dict, references:
             }
         )
 
-    # Remove duplicates
-    tmp = {}
+    # Remove duplicates and reorder for optional params to be last
+    seen = set()
+    required = []
+    optional = []
     for p in skel["list"]:
-        if p["name"].lower() not in tmp:
-            tmp[p["name"].lower()] = p
-    skel["list"] = tmp.values()
-
-    # reorder for optional params to be last
-    if skel["has_optional_params"]:
-        skel["list"] = [e for e in skel["list"] if e["required"]] + [e for e in skel["list"] if not e["required"]]
+        name = p["name"].lower()
+        if name in seen:
+            continue
+        seen.add(name)
+        (required if p["required"] else optional).append(p)
+    skel["list"] = required + optional
     return skel
 
 
@@ -384,12 +414,10 @@ def resolve_references(spec: dict) -> dict:
     return references
 
 
+@functools.lru_cache(maxsize=None)
 def type_replacement(t: str) -> str:
     orig_type = t.lower()
-    for is_type, replacement in TYPE_REPLACEMENTS.items():
-        if orig_type == is_type:
-            return replacement
-    return orig_type
+    return TYPE_REPLACEMENTS.get(orig_type, orig_type)
 
 
 def checksum(dictionary: Dict[str, Any]) -> str:
@@ -405,6 +433,7 @@ def checksum(dictionary: Dict[str, Any]) -> str:
     return dhash.hexdigest()
 
 
+@functools.lru_cache(maxsize=None)
 def _sanitize_filename(n: str) -> str:
     return n.replace(" ", "_").lower()
 
@@ -413,11 +442,13 @@ def _sanitize_filename(n: str) -> str:
 #                         MAIN                            #
 # ------------------------------------------------------- #
 if __name__ == "__main__":
-    for scope in SPECS.keys():
-        # fetch spec
-        spec = fetch_openapi_specs(SPECS[scope]["spec_url"])
+    # fetch specs
+    with ThreadPoolExecutor(max_workers=len(SPECS)) as executor:
+        specs = dict(zip(SPECS, executor.map(fetch_openapi_specs, [s["spec_url"] for s in SPECS.values()])))
 
+    for scope, spec in specs.items():
         # Init schema out
+        SCHEMA_ENDPOINTS = []
         SCHEMA_OUT = {
             "scope": scope,
             "version_spec": spec["info"]["version"],
@@ -425,7 +456,7 @@ if __name__ == "__main__":
             "checksum": checksum(spec),
             "generated_on": to_rfc339(datetime.datetime.now(datetime.timezone.utc)),
             "base_url": SPECS[scope]["base_url"],
-            "endpoints": [],
+            "endpoints": SCHEMA_ENDPOINTS,
         }
 
         # filter out endpointless namespaces
@@ -440,9 +471,10 @@ if __name__ == "__main__":
         # generate namespaces
         logging.info("generating %d namespaces .." % len(namespaces))
         it = 1
+        buffers = {}
         for n in namespaces:
             logging.info("[%2d/%2d] creating %s" % (it, len(namespaces), n["name"]))
-            generate_namespace(n, scope, spec["info"]["version"], SPECS[scope]["base_url"])
+            generate_namespace(n, scope, spec["info"]["version"], SPECS[scope]["base_url"], buffers)
             it += 1
 
         # generate paths
@@ -452,13 +484,13 @@ if __name__ == "__main__":
             logging.info(
                 "[%2d/%2d] %s: %s" % (it, len(spec["paths"]), path, endpoints.get("summary", "MISSING-SUMMARY"))
             )
-            generate_endpoints(path, endpoints, references)
+            generate_endpoints(path, endpoints, references, buffers)
             it += 1
+        write_namespaces(buffers)
 
         # fan out schema to docs
-        schema_dump = open(f"codegen/ws/{scope}.json", "w")
-        json.dump(SCHEMA_OUT, schema_dump, indent=2)
-        schema_dump.close()
+        with open(f"{WS_DIR}/{scope}.json", "w", buffering=WRITE_BUFFER_SIZE) as schema_dump:
+            json.dump(SCHEMA_OUT, schema_dump, indent=2)
         logging.info("persisted new schema docs.")
 
     logging.info("done.")